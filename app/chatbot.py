@@ -1,25 +1,84 @@
 import streamlit as st
-from services.qa_pipeline import query_knowledgebase
-from services.file_manager import file_manager
+from services.qa_pipeline import stream_knowledgebase, summarize_conversation
+from services.file_manager import get_file_manager
 from services.conversation_manager import conversation_manager
-from services.file_processor import file_processor
-from config import PROCESSING_DELAY_SECONDS
+from services.file_processor import get_file_processor
+from services.session_store import session_store, new_session_id, is_valid_session_id
 import time
 
+file_manager = get_file_manager()
+file_processor = get_file_processor()
+
+@st.cache_data(show_spinner=False)
+def _cached_db_stats(version: int):
+    """Database statistics, recomputed only when the database version changes."""
+    return file_manager.get_database_statistics()
+
 st.title("Bot Assistant")
 st.caption("Upload documents or ask questions")
 
-# Initialize session state for conversation
+# Key persisted history on an id kept in the URL, so it survives reloads and
+# server restarts; Streamlit's own session id is new for every connection
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("sid")
+    if not is_valid_session_id(session_id):
+        session_id = new_session_id()
+        st.query_params["sid"] = session_id
+    st.session_state.session_id = session_id
+session_id = st.session_state.session_id
+
+# Initialize session state for conversation, restoring any persisted history
 if "history" not in st.session_state:
-    st.session_state.history = []
+    st.session_state.history = session_store.load(session_id)
+if "history_stats" not in st.session_state:
+    # Cold start: derive running role counts from any existing history
+    summary = conversation_manager.get_conversation_summary(st.session_state.history)
+    st.session_state.history_stats = {
+        "user": summary["user_messages"],
+        "assistant": summary["assistant_messages"]
+    }
 if "pending_bot_reply" not in st.session_state:
     st.session_state.pending_bot_reply = False
 if "processing_started" not in st.session_state:
     st.session_state.processing_started = False
 if "file_uploader_key" not in st.session_state:
     st.session_state.file_uploader_key = 0
+if "pending_key_bump_at" not in st.session_state:
+    st.session_state.pending_key_bump_at = None
 
-with st.sidebar:
+# Local handle to the history list; rebind whenever the list is replaced
+hist = st.session_state.history
+
+def is_code_block(content: str) -> bool:
+    """Check whether a message is a single fenced code block."""
+    stripped = content.strip()
+    return stripped.startswith("```") and stripped.endswith("```")
+
+# Delay before clearing the uploader, so toasts stay visible
+UPLOADER_RESET_DELAY_SECONDS = 2
+
+def schedule_uploader_reset():
+    """Clear the uploader once the toast has had time to disappear, without blocking."""
+    st.session_state.pending_key_bump_at = time.monotonic() + UPLOADER_RESET_DELAY_SECONDS
+
+@st.fragment(run_every=0.5)
+def _uploader_reset_watcher():
+    """Poll the pending deadline and clear the uploader once it has passed."""
+    deadline = st.session_state.pending_key_bump_at
+    # A queued tick can still fire after the deadline was handled
+    if deadline is None:
+        return
+    if time.monotonic() >= deadline:
+        st.session_state.pending_key_bump_at = None
+        st.session_state.file_uploader_key += 1
+        st.rerun()
+
+if st.session_state.pending_key_bump_at is not None:
+    _uploader_reset_watcher()
+
+@st.fragment
+def render_upload_section():
+    """Upload and processing pane; reruns independently of the chat pane."""
     st.header("📂 Upload Files")
     uploaded_files = st.file_uploader(
         "Upload PDF/TXT files",
@@ -36,41 +95,40 @@ with st.sidebar:
         # Start processing if not already processing and not in bot reply
         if not file_processor.is_processing() and not st.session_state.pending_bot_reply:
             # Only try to start processing if we're not already in a processing cycle
-            if file_processor.state.status.value == "idle" and not st.session_state.processing_started:
+            if (file_processor.state.status.value == "idle" and not st.session_state.processing_started
+                    and st.session_state.pending_key_bump_at is None):
                 success, message = file_processor.start_processing(uploaded_files)
                 if success:
+                    # Fall through and process the whole batch in this run
                     st.session_state.processing_started = True
-                    st.rerun()
                 else:
                     # If all files are already in the database, show toast, then reset uploader after delay
                     st.toast(message, icon="ℹ️")
-                    time.sleep(2)
-                    st.session_state.file_uploader_key += 1
+                    schedule_uploader_reset()
                     st.rerun()
         
-        # Continue processing if in progress
+        # Process all queued files in a single run, updating progress in place
         if file_processor.is_processing():
             progress, message = file_processor.get_progress()
-            if progress is not None:
-                st.progress(progress)
-                if message:
-                    st.text(message)
+            progress_bar = st.progress(progress or 0.0)
+            status_text = st.empty()
+            if message:
+                status_text.text(message)
             
-            # Process next file
-            if file_processor.process_next_file(uploaded_files):
-                # Small delay to show progress
-                time.sleep(PROCESSING_DELAY_SECONDS)
-                st.rerun()
-            else:
-                # Processing complete or cancelled
-                if file_processor.state.status.value == "completed":
-                    # Reset processor after completion
-                    file_processor.reset()
-                    st.session_state.processing_started = False
-                    # Wait for toast to disappear before clearing uploader
-                    time.sleep(2)
-                    st.session_state.file_uploader_key += 1
-                st.rerun()
+            def on_progress(progress: float, message: str):
+                progress_bar.progress(progress)
+                status_text.text(message)
+            
+            file_processor.process_all(uploaded_files, on_progress=on_progress)
+            
+            # Processing complete or cancelled
+            if file_processor.state.status.value == "completed":
+                # Reset processor after completion
+                file_processor.reset()
+                st.session_state.processing_started = False
+                # Wait for toast to disappear before clearing uploader
+                schedule_uploader_reset()
+            st.rerun()
     
     else:
         # No files uploaded - cancel any ongoing processing only if it was started
@@ -78,26 +136,33 @@ with st.sidebar:
             file_processor.cancel_processing("Processing cancelled - no files selected")
             file_processor.reset()
             # Wait for toast to disappear before clearing uploader
-            time.sleep(2)
-            st.session_state.file_uploader_key += 1
+            schedule_uploader_reset()
+            st.session_state.processing_started = False
+            st.rerun()
         # Reset processing started flag when no files
         st.session_state.processing_started = False
+
+with st.sidebar:
+    render_upload_section()
     
     st.divider()
     st.header("💬 Conversation")
     
     # Display conversation stats
-    if st.session_state.history:
-        stats = conversation_manager.get_conversation_summary(st.session_state.history)
-        st.info(f"Messages: {stats['total_messages']} | User: {stats['user_messages']} | Assistant: {stats['assistant_messages']}")
+    if hist:
+        stats = st.session_state.history_stats
+        # The rolling summary is a system message, so count only user and assistant turns
+        st.info(f"Messages: {stats['user'] + stats['assistant']} | User: {stats['user']} | Assistant: {stats['assistant']}")
         
         # Show if history needs truncation
-        if conversation_manager.should_truncate_history(st.session_state.history):
+        if len(hist) > conversation_manager.config.max_history_length:
             st.warning("⚠️ Long conversation - older messages may be truncated")
     
     # Clear conversation button
     if st.button("🗑️ Clear Conversation", use_container_width=True):
         st.session_state.history = []
+        st.session_state.history_stats = {"user": 0, "assistant": 0}
+        session_store.mark_dirty(session_id, st.session_state.history)
         st.session_state.pending_bot_reply = False
         # Don't reset file processor here - let it continue if processing
         st.rerun()
@@ -106,7 +171,7 @@ with st.sidebar:
     st.header("🗄️ Database Management")
     
     # Get database statistics
-    db_stats = file_manager.get_database_statistics()
+    db_stats = _cached_db_stats(file_manager.db_version)
     
     # Display database stats
     if db_stats['total_documents'] > 0:
@@ -138,8 +203,7 @@ with st.sidebar:
                                     if file_manager.remove_documents_by_filename(filename):
                                         st.toast(f"Successfully removed {filename}", icon="✅")
                                         # Wait for toast to disappear before clearing uploader
-                                        time.sleep(2)
-                                        st.session_state.file_uploader_key += 1
+                                        schedule_uploader_reset()
                                         st.rerun()
                                     else:
                                         st.error(f"❌ Failed to remove {filename}")
@@ -166,8 +230,7 @@ with st.sidebar:
                     if file_manager.clear_all_documents():
                         st.toast("All documents cleared", icon="✅")
                         # Wait for toast to disappear before clearing uploader
-                        time.sleep(2)
-                        st.session_state.file_uploader_key += 1
+                        schedule_uploader_reset()
                         # Force a rerun to refresh the UI
                         st.rerun()
                     else:
@@ -183,34 +246,74 @@ user_input = st.chat_input("Type your question here...")
 if user_input:
     submit_input = user_input.strip()
     if submit_input:
-        # Truncate history if needed before adding new message
-        if conversation_manager.should_truncate_history(st.session_state.history):
-            st.session_state.history = conversation_manager.truncate_history(st.session_state.history)
+        # Keep history within the window, summarizing messages that roll off
+        if len(hist) > conversation_manager.config.max_history_length:
+            with st.spinner("Summarizing earlier conversation..."):
+                windowed_history = conversation_manager.compress_old_messages(hist, summarize_conversation)
+        else:
+            windowed_history = hist
+        if windowed_history is not hist:
+            st.session_state.history = hist = windowed_history
+            # Recount roles for the messages that survived truncation
+            summary = conversation_manager.get_conversation_summary(hist)
+            st.session_state.history_stats = {
+                "user": summary["user_messages"],
+                "assistant": summary["assistant_messages"]
+            }
         
-        st.session_state.history.append({"role": "user", "content": submit_input})
+        hist.append({"role": "user", "content": submit_input})
+        st.session_state.history_stats["user"] += 1
+        session_store.mark_dirty(session_id, hist)
         st.session_state.pending_bot_reply = True
         st.rerun()
 
-for chat in st.session_state.history:
+def render_message(chat):
+    """Render a single chat message."""
     with st.chat_message(chat["role"]):
         if chat["role"] == "assistant":
-            if chat["content"].strip().startswith("```") and chat["content"].strip().endswith("```"):
+            # Code detection is done once, when the message is appended
+            if chat.get("is_code"):
                 st.code(chat["content"].strip().strip("`"))
             else:
                 st.markdown(chat["content"])
         else:
             st.markdown(chat["content"], unsafe_allow_html=False)
 
-if st.session_state.pending_bot_reply:
+@st.fragment
+def render_history():
+    """Chat pane; isolated from the upload pane's rerun loop."""
+    history = st.session_state.history
+    for chat in history:
+        # The rolling summary is LLM context only
+        if chat["role"] == "system":
+            continue
+        render_message(chat)
+
+render_history()
+
+@st.fragment
+def answer_pending_question():
+    """Answer the latest question, streaming the reply in place without a full rerun."""
+    if not st.session_state.pending_bot_reply:
+        return
+    history = st.session_state.history
     with st.spinner("Bot is typing..."):
         # Get the current question
-        current_question = st.session_state.history[-1]["content"]
+        current_question = history[-1]["content"]
         # Get conversation history (exclude the current question)
-        conversation_history = st.session_state.history[:-1]
-        
-        # Query with conversation context
-        answer = query_knowledgebase(current_question, conversation_history)
+        conversation_history = history[:-1]
         
-    st.session_state.history.append({"role": "assistant", "content": answer})
+        # Retrieve context now; the answer itself streams below
+        answer_stream = stream_knowledgebase(current_question, conversation_history)
+    
+    with st.chat_message("assistant"):
+        answer = st.write_stream(answer_stream)
+    
+    # Later reruns render the stored message, including code detection
+    message = {"role": "assistant", "content": answer, "is_code": is_code_block(answer)}
+    history.append(message)
+    st.session_state.history_stats["assistant"] += 1
+    session_store.mark_dirty(session_id, history)
     st.session_state.pending_bot_reply = False
-    st.rerun()
\ No newline at end of file
+
+answer_pending_question()
@@ -1,9 +1,12 @@
 """
 Central configuration and environment variable access for the app.
 """
+from __future__ import annotations
+
 import os
+from types import MappingProxyType
 from dotenv import load_dotenv
-from typing import List
+from typing import Final, Mapping
 
 load_dotenv()
 
@@ -13,32 +16,39 @@ MILVUS_URI = os.getenv("MILVUS_URI")
 MILVUS_TOKEN = os.getenv("MILVUS_TOKEN")
 
 # File upload settings
-SUPPORTED_FILE_TYPES = ["pdf", "txt"]
-MAX_FILE_SIZE_MB = 100  # Maximum file size in MB
-MAX_FILES_PER_UPLOAD = 10  # Maximum number of files per upload
+SUPPORTED_FILE_TYPES: Final = ("pdf", "txt")
+MAX_FILE_SIZE_MB: Final = 100  # Maximum file size in MB
+MAX_FILES_PER_UPLOAD: Final = 10  # Maximum number of files per upload
 
 # Processing settings
-PROCESSING_DELAY_SECONDS = 0.1  # Delay between file processing steps
-MAX_RETRIES = 3  # Maximum retries for failed operations
+MAX_RETRIES: Final = 3  # Maximum retries for failed operations
+MAX_PROCESSING_WORKERS: Final = 4  # Files loaded and embedded concurrently
 
 # Database settings
-DB_PERSIST_DIRECTORY = "./db/chroma_db"
-DB_COLLECTION_NAME = "confluence_knowledge_base"
+DB_PERSIST_DIRECTORY: Final = "./db/chroma_db"
+DB_COLLECTION_NAME: Final = "confluence_knowledge_base"
+DB_ADD_BATCH_SIZE: Final = 5000  # Chunks embedded and written per collection.add call
+EMBEDDING_CACHE_PATH: Final = "./db/embedding_cache.sqlite3"  # Chunk embeddings keyed by content hash
 
 # LLM settings
-DEFAULT_LLM_MODEL = "llama3.1:latest"
-MAX_CONTEXT_LENGTH = 8192  # Maximum context length for LLM
+DEFAULT_LLM_MODEL: Final = "llama3.1:latest"
+MAX_CONTEXT_LENGTH: Final = 8192  # Maximum context length for LLM
+MAX_RETRIEVED_CONTEXT_TOKENS: Final = 2048  # Token budget for retrieved chunks in a prompt
 
 # Conversation settings
-MAX_CONVERSATION_HISTORY = 20  # Maximum number of messages to keep in history
-TRUNCATION_THRESHOLD = 15  # Truncate when history exceeds this length
+MAX_CONVERSATION_HISTORY: Final = 20  # Maximum number of messages to keep in history
+TRUNCATION_THRESHOLD: Final = 15  # Truncate when history exceeds this length
+SESSION_STORE_DIRECTORY: Final = "./data/sessions"  # Where chat histories are persisted
+SESSION_FLUSH_INTERVAL_SECONDS: Final = 15  # Background flush interval for chat histories
+SESSION_IDLE_TTL_SECONDS: Final = 60 * 60  # Evict idle sessions from memory after this long
+SESSION_FILE_TTL_SECONDS: Final = 7 * 24 * 60 * 60  # Delete persisted histories untouched for this long
 
 # UI settings
-SIDEBAR_WIDTH = 300  # Sidebar width in pixels
-PROGRESS_BAR_HEIGHT = 20  # Progress bar height in pixels
+SIDEBAR_WIDTH: Final = 300  # Sidebar width in pixels
+PROGRESS_BAR_HEIGHT: Final = 20  # Progress bar height in pixels
 
 # Error messages
-ERROR_MESSAGES = {
+ERROR_MESSAGES: Final[Mapping[str, str]] = MappingProxyType({
     "file_not_found": "File not found or has been removed",
     "processing_failed": "Failed to process file",
     "database_error": "Database operation failed",
@@ -46,33 +56,33 @@ ERROR_MESSAGES = {
     "invalid_file_type": "Invalid file type. Supported types: {types}",
     "file_too_large": "File too large. Maximum size: {size}MB",
     "too_many_files": "Too many files. Maximum: {count} files"
-}
+})
 
 # Success messages
-SUCCESS_MESSAGES = {
+SUCCESS_MESSAGES: Final[Mapping[str, str]] = MappingProxyType({
     "file_processed": "File processed successfully",
     "files_processed": "All files processed successfully",
     "database_cleared": "Database cleared successfully",
     "file_removed": "File removed successfully"
-}
+})
 
 # Status messages
-STATUS_MESSAGES = {
+STATUS_MESSAGES: Final[Mapping[str, str]] = MappingProxyType({
     "starting": "Starting processing...",
     "processing": "Processing {filename}... ({current}/{total})",
     "completed": "Processing complete",
     "cancelled": "Processing cancelled",
     "skipped": "Skipped {filename} ({reason})"
-}
+})
 
 def get_error_message(key: str, **kwargs) -> str:
     """Get formatted error message"""
-    return ERROR_MESSAGES.get(key, "Unknown error").format(**kwargs)
+    return ERROR_MESSAGES.get(key, "Unknown error").format_map(kwargs)
 
 def get_success_message(key: str, **kwargs) -> str:
     """Get formatted success message"""
-    return SUCCESS_MESSAGES.get(key, "Success").format(**kwargs)
+    return SUCCESS_MESSAGES.get(key, "Success").format_map(kwargs)
 
 def get_status_message(key: str, **kwargs) -> str:
     """Get formatted status message"""
-    return STATUS_MESSAGES.get(key, "Status").format(**kwargs)
+    return STATUS_MESSAGES.get(key, "Status").format_map(kwargs)
@@ -0,0 +1,16 @@
+"""
+Shared Chroma vector store for the app.
+"""
+import functools
+from langchain_chroma import Chroma
+from services.embeddings import get_embeddings
+from config import DB_PERSIST_DIRECTORY, DB_COLLECTION_NAME
+
+@functools.lru_cache(maxsize=1)
+def get_vectorstore() -> Chroma:
+    """Get the process-wide Chroma store, so the index is opened only once."""
+    return Chroma(
+        embedding_function=get_embeddings(),
+        persist_directory=DB_PERSIST_DIRECTORY,
+        collection_name=DB_COLLECTION_NAME
+    )
@@ -1,21 +1,37 @@
 """
 Conversation management utilities for maintaining chat context.
 """
-from typing import List, Dict, Any
+from __future__ import annotations
+
+from typing import List, Dict, Any, Callable
+from collections import Counter, OrderedDict
 from dataclasses import dataclass
 from datetime import datetime
+import threading
+
+# Prefixes used when rendering each role into the LLM prompt
+ROLE_PREFIX = {
+    "system": "Summary of earlier conversation: ",
+    "user": "User: ",
+    "assistant": "Assistant: "
+}
 
 @dataclass
 class ConversationConfig:
     """Configuration for conversation management."""
     max_history_length: int = 10  # Maximum number of messages to keep
     max_context_length: int = 6   # Maximum messages to include in LLM context
+    format_cache_size: int = 64   # Formatted context windows remembered across sessions
 
 class ConversationManager:
     """Manages conversation history and context."""
     
     def __init__(self, config: ConversationConfig = None):
         self.config = config or ConversationConfig()
+        # Message-id tuple -> (messages, formatted) for recent context windows, one or
+        # more per session; holding the message references keeps their ids stable
+        self._fmt_cache: OrderedDict = OrderedDict()
+        self._fmt_lock = threading.Lock()
     
     def format_history_for_llm(self, history: List[Dict[str, str]]) -> str:
         """
@@ -33,45 +49,100 @@ class ConversationManager:
         # Take only the most recent messages within context limit
         recent_history = history[-self.config.max_context_length:]
         
-        formatted_messages = []
-        for message in recent_history:
-            role = message.get("role", "")
-            content = message.get("content", "")
-            
-            if role == "user":
-                formatted_messages.append(f"User: {content}")
-            elif role == "assistant":
-                formatted_messages.append(f"Assistant: {content}")
+        # Always keep the rolling summary of older messages, if there is one
+        if history[0].get("role") == "system" and len(history) > len(recent_history):
+            recent_history = [history[0]] + recent_history
+        
+        # Messages are append-only dicts, so an identical window formats identically
+        key = tuple(map(id, recent_history))
+        with self._fmt_lock:
+            cached = self._fmt_cache.get(key)
+            if cached is not None:
+                self._fmt_cache.move_to_end(key)
+                return cached[1]
         
-        return "\n".join(formatted_messages) if formatted_messages else "No previous conversation."
+        formatted_messages = [
+            ROLE_PREFIX[message["role"]] + message["content"]
+            for message in recent_history
+            if message.get("role") in ROLE_PREFIX
+        ]
+        
+        formatted = "\n".join(formatted_messages) if formatted_messages else "No previous conversation."
+        with self._fmt_lock:
+            self._fmt_cache[key] = (recent_history, formatted)
+            if len(self._fmt_cache) > self.config.format_cache_size:
+                self._fmt_cache.popitem(last=False)
+        return formatted
     
-    def should_truncate_history(self, history: List[Dict[str, str]]) -> bool:
-        """Check if conversation history should be truncated."""
-        return len(history) > self.config.max_history_length
+    def enforce_window(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Apply the sliding history window in a single step.
+        Returns the history unchanged when it is within the limit.
+        """
+        max_length = self.config.max_history_length
+        return history if len(history) <= max_length else history[-max_length:]
     
-    def truncate_history(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    def compress_old_messages(self, history: List[Dict[str, str]],
+                              summarize: Callable[[str, str], str],
+                              keep_last: int = None) -> List[Dict[str, str]]:
         """
-        Truncate conversation history to maintain performance.
-        Keeps the most recent messages within the limit.
+        Fold messages that fall out of the window into a rolling summary.
+        
+        Args:
+            history: List of messages, optionally starting with a system summary
+            summarize: Callable taking (transcript, previous_summary) and returning the new summary
+            keep_last: Number of recent messages to keep verbatim
+            
+        Returns:
+            The history unchanged when within the limit, otherwise the summary
+            message followed by the most recent messages
         """
-        if len(history) <= self.config.max_history_length:
+        max_length = self.config.max_history_length
+        if len(history) <= max_length:
             return history
         
-        # Keep the most recent messages
-        return history[-self.config.max_history_length:]
+        keep_last = min(keep_last or self.config.max_context_length, max_length - 1)
+        
+        # The summary is cumulative: it is regenerated only when messages roll off
+        previous_summary = ""
+        messages = history
+        if history[0].get("role") == "system":
+            previous_summary = history[0]["content"]
+            messages = history[1:]
+        
+        transcript = "\n".join(
+            ROLE_PREFIX[message["role"]] + message["content"]
+            for message in messages[:-keep_last]
+            if message.get("role") in ROLE_PREFIX
+        )
+        
+        try:
+            summary = summarize(transcript, previous_summary).strip()
+        except Exception as e:
+            print(f"Error summarizing conversation: {e}")
+            summary = ""
+        
+        if not summary:
+            if previous_summary:
+                # Keep the summary earlier turns already paid for; only this batch is lost
+                return [history[0]] + messages[-keep_last:]
+            # Fall back to plain truncation
+            return self.enforce_window(history)
+        
+        return [{"role": "system", "content": summary}] + messages[-keep_last:]
     
     def get_conversation_summary(self, history: List[Dict[str, str]]) -> Dict[str, Any]:
         """Get summary statistics about the conversation."""
         if not history:
             return {"total_messages": 0, "user_messages": 0, "assistant_messages": 0}
         
-        user_messages = sum(1 for msg in history if msg.get("role") == "user")
-        assistant_messages = sum(1 for msg in history if msg.get("role") == "assistant")
+        # Count roles in a single pass over the history
+        counts = Counter(msg.get("role", "") for msg in history)
         
         return {
             "total_messages": len(history),
-            "user_messages": user_messages,
-            "assistant_messages": assistant_messages,
+            "user_messages": counts["user"],
+            "assistant_messages": counts["assistant"],
             "last_message_time": datetime.now().isoformat()
         }
 
@@ -0,0 +1,281 @@
+"""
+Document loading and splitting for ingestion.
+Kept free of vector store and LLM imports so it can run in worker processes.
+"""
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from pypdf import PdfReader
+from typing import List, Dict, Tuple
+import functools
+import io
+
+def load_documents_from_bytes(content: bytes, name: str, ext: str) -> List[Document]:
+    """
+    Load documents from in-memory file content, without a temporary file.
+    
+    Args:
+        content: Raw file bytes
+        name: Original filename, used as the document source
+        ext: Lowercase file extension including the dot
+        
+    Returns:
+        One document per PDF page, or a single document for text files
+    """
+    if ext == '.pdf':
+        reader = PdfReader(io.BytesIO(content))
+        return [
+            Document(page_content=page.extract_text() or "", metadata={'source': name, 'page': page_number})
+            for page_number, page in enumerate(reader.pages)
+        ]
+    return [Document(page_content=content.decode('utf-8'), metadata={'source': name})]
+
+@functools.lru_cache(maxsize=16)
+def _make_splitter(chunk_size: int, chunk_overlap: int, separators: Tuple[str, ...]) -> RecursiveCharacterTextSplitter:
+    """Build a splitter once per parameter set; splitters hold no per-call state and are shared."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=list(separators)
+    )
+
+def get_dynamic_text_splitter(text_length: int) -> RecursiveCharacterTextSplitter:
+    """
+    Create a text splitter with dynamic parameters based on text length.
+    
+    Args:
+        text_length: Total length of the text to be split
+        
+    Returns:
+        RecursiveCharacterTextSplitter with optimized parameters
+    """
+    if text_length <= 5000:
+        # Small documents: smaller chunks for better granularity
+        chunk_size = 500
+        chunk_overlap = 100
+    elif text_length <= 20000:
+        # Medium documents: standard chunks
+        chunk_size = 1000
+        chunk_overlap = 200
+    elif text_length <= 50000:
+        # Large documents: larger chunks for better context
+        chunk_size = 1500
+        chunk_overlap = 300
+    else:
+        # Very large documents: even larger chunks
+        chunk_size = 2000
+        chunk_overlap = 400
+    
+    return _make_splitter(chunk_size, chunk_overlap, ("\n\n", "\n", " ", ""))
+
+def analyze_document_content(docs) -> Dict[str, any]:
+    """
+    Analyze document content to determine optimal splitting strategy.
+    
+    Args:
+        docs: List of document objects
+        
+    Returns:
+        Dictionary with content analysis results
+    """
+    contents = [doc.page_content for doc in docs]
+    total_length = sum(map(len, contents))
+    avg_page_length = total_length / len(docs) if docs else 0
+    
+    # Count over one joined buffer; the NUL separator keeps matches from spanning pages
+    joined = "\0".join(contents)
+    newline_density = joined.count('\n') / total_length if total_length > 0 else 0
+    paragraph_density = joined.count('\n\n') / total_length if total_length > 0 else 0
+    
+    content_type = "structured" if paragraph_density > 0.01 else "continuous"
+    
+    return {
+        "total_length": total_length,
+        "avg_page_length": avg_page_length,
+        "newline_density": newline_density,
+        "paragraph_density": paragraph_density,
+        "content_type": content_type,
+        "num_pages": len(docs)
+    }
+
+class _PassThroughSplitter:
+    """Splitter for text that already fits in one chunk; keeps each non-empty page as is"""
+
+    _chunk_overlap = 0
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        return [doc for doc in docs if doc.page_content.strip()]
+
+_PASS_THROUGH_SPLITTER = _PassThroughSplitter()
+
+def get_optimized_text_splitter(docs, analysis: Dict[str, any] = None) -> Tuple[RecursiveCharacterTextSplitter, int]:
+    """
+    Get an optimized text splitter based on document analysis.
+    
+    Args:
+        docs: List of document objects
+        analysis: Precomputed analyze_document_content result, if available
+        
+    Returns:
+        Tuple of (RecursiveCharacterTextSplitter, chunk_size) with optimized parameters;
+        a pass-through splitter when the whole text fits in one chunk
+    """
+    if analysis is None:
+        analysis = analyze_document_content(docs)
+    
+    # Base parameters from dynamic splitting
+    base_splitter = get_dynamic_text_splitter(analysis["total_length"])
+    
+    # Get chunk size and overlap from the base splitter
+    try:
+        base_chunk_size = base_splitter._chunk_size
+        base_overlap = base_splitter._chunk_overlap
+    except AttributeError:
+        # Fallback to default values if attributes aren't available
+        if analysis["total_length"] <= 5000:
+            base_chunk_size, base_overlap = 500, 100
+        elif analysis["total_length"] <= 20000:
+            base_chunk_size, base_overlap = 1000, 200
+        elif analysis["total_length"] <= 50000:
+            base_chunk_size, base_overlap = 1500, 300
+        else:
+            base_chunk_size, base_overlap = 2000, 400
+    
+    # Adjust based on content structure
+    if analysis["content_type"] == "structured":
+        # For structured content, prioritize paragraph breaks
+        separators = ("\n\n", "\n", ". ", " ", "")
+        # Slightly smaller chunks for structured content
+        chunk_size = int(base_chunk_size * 0.9)
+    else:
+        # For continuous content, use standard separators
+        separators = ("\n\n", "\n", " ", "")
+        chunk_size = base_chunk_size
+    
+    # Nothing to split: skip the separator cascade entirely
+    if analysis["total_length"] <= chunk_size:
+        return _PASS_THROUGH_SPLITTER, chunk_size
+    
+    splitter = _make_splitter(chunk_size, base_overlap, separators)
+    
+    return splitter, chunk_size
+
+def get_chunk_statistics(chunks) -> Dict[str, any]:
+    """
+    Get statistics about the generated chunks.
+    
+    Args:
+        chunks: List of text chunks
+        
+    Returns:
+        Dictionary with chunk statistics
+    """
+    if not chunks:
+        return {"count": 0, "avg_length": 0, "min_length": 0, "max_length": 0}
+    
+    # Single pass without materializing a list of lengths
+    count = total_length = max_length = 0
+    min_length = None
+    for chunk in chunks:
+        length = len(chunk.page_content)
+        count += 1
+        total_length += length
+        if min_length is None or length < min_length:
+            min_length = length
+        if length > max_length:
+            max_length = length
+    
+    return {
+        "count": count,
+        "avg_length": total_length / count,
+        "min_length": min_length,
+        "max_length": max_length,
+        "total_length": total_length
+    }
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting prompts (about four characters per token)."""
+    return len(text) // 4
+
+def merge_small_chunks(chunks: List[Document], source_text: str, min_size: int, max_size: int,
+                       overlap: int = 0) -> List[Document]:
+    """
+    Merge undersized chunks of one page into their neighbours after splitting.
+    
+    Args:
+        chunks: Chunks of source_text in order
+        source_text: The page text the chunks were split from
+        min_size: Chunks shorter than this are merged with an adjacent chunk
+        max_size: Merged chunks never grow beyond this length
+        overlap: Chunk overlap the splitter was configured with
+        
+    Returns:
+        Chunks in document order, with small neighbours combined
+    """
+    merged = []
+    previous_span = None  # (start, end) of merged[-1] in source_text, if located
+    search_from = 0
+    for chunk in chunks:
+        start = source_text.find(chunk.page_content, search_from)
+        if start == -1:
+            # Can't place this chunk in the page, so never merge across it
+            merged.append(chunk)
+            previous_span = None
+            continue
+        end = start + len(chunk.page_content)
+        # The next chunk starts at most `overlap` characters before this one ends
+        search_from = max(0, end - overlap)
+        
+        if previous_span is not None:
+            previous = merged[-1]
+            span_start = previous_span[0]
+            if ((len(previous.page_content) < min_size or len(chunk.page_content) < min_size)
+                    and end - span_start <= max_size):
+                # Take the original text spanning both chunks: overlapping text appears
+                # once and the original separator between them is kept
+                merged[-1] = Document(page_content=source_text[span_start:end], metadata=previous.metadata)
+                previous_span = (span_start, end)
+                continue
+        merged.append(chunk)
+        previous_span = (start, end)
+    return merged
+
+def split_documents(docs: List[Document]) -> Tuple[List[Document], Dict[str, any], Dict[str, any], int]:
+    """
+    Split loaded documents with a splitter tuned to their content.
+    
+    Args:
+        docs: Loaded documents of one file
+        
+    Returns:
+        Tuple of (chunks, content analysis, chunk statistics, chunk_size)
+    """
+    analysis = analyze_document_content(docs)
+    optimized_splitter, chunk_size = get_optimized_text_splitter(docs, analysis)
+    # Split and merge page by page, so merges never cross pages and chunks can be
+    # located in their page text
+    split_docs = []
+    for doc in docs:
+        split_docs.extend(merge_small_chunks(
+            optimized_splitter.split_documents([doc]),
+            doc.page_content,
+            min_size=int(chunk_size * 0.3),
+            max_size=int(chunk_size * 1.1),
+            overlap=optimized_splitter._chunk_overlap
+        ))
+    return split_docs, analysis, get_chunk_statistics(split_docs), chunk_size
+
+def load_and_split(content: bytes, name: str, ext: str) -> Tuple[int, List[Document], Dict[str, any], Dict[str, any], int]:
+    """
+    Parse and split one in-memory file; picklable entry point for the process pool.
+    
+    Args:
+        content: Raw file bytes
+        name: Original filename, used as the document source
+        ext: Lowercase file extension including the dot
+        
+    Returns:
+        Tuple of (page count, chunks, content analysis, chunk statistics, chunk_size)
+    """
+    docs = load_documents_from_bytes(content, name, ext)
+    return (len(docs),) + split_documents(docs)
@@ -1,11 +1,141 @@
 """
 Ollama embedding services for the app.
 """
-from langchain_ollama import OllamaEmbeddings 
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import streamlit as st
+from langchain_ollama import OllamaEmbeddings
+from services.ingest_logging import ingest_log
+from config import EMBEDDING_CACHE_PATH
 
-# Example usage:
-ollama_embeddings = OllamaEmbeddings(
-    base_url="http://localhost:11434",
-    model="nomic-embed-text:v1.5"
-)
+@st.cache_resource
+def get_embeddings() -> OllamaEmbeddings:
+    """Get the shared Ollama embeddings client, built once per process."""
+    return OllamaEmbeddings(
+        base_url="http://localhost:11434",
+        model="nomic-embed-text:v1.5"
+    )
 
+@functools.lru_cache(maxsize=1024)
+def embed_query_cached(text: str) -> Tuple[float, ...]:
+    """
+    Embed a search query, reusing the vector for repeated queries.
+    
+    Args:
+        text: Query text
+        
+    Returns:
+        The query embedding as an immutable tuple
+    """
+    return tuple(get_embeddings().embed_query(text))
+
+class EmbeddingCache:
+    """On-disk map from chunk content hash to embedding, shared by all sessions"""
+
+    # Stay under SQLite's bound-parameter limit in lookups
+    _LOOKUP_BATCH = 500
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        """Hash a text together with the model that embeds it"""
+        return hashlib.sha1(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Look up cached vectors; missing keys are absent from the result"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self._LOOKUP_BATCH):
+                batch = keys[start:start + self._LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[bytes, List[float]]):
+        """Store vectors by key, replacing any existing entries"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items.items()]
+            )
+
+@functools.lru_cache(maxsize=1)
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the process-wide embedding cache, opened on first use."""
+    return EmbeddingCache()
+
+def embed_batch(texts: List[str], batch_size: int = 64, max_concurrency: int = 4) -> List[List[float]]:
+    """
+    Embed texts, reusing cached vectors for content that was embedded before.
+    
+    Args:
+        texts: Texts to embed
+        batch_size: Maximum number of texts sent in a single request
+        max_concurrency: Maximum number of batch requests in flight
+        
+    Returns:
+        Embedding vectors in the same order as the input texts
+    """
+    try:
+        cache = get_embedding_cache()
+        model = get_embeddings().model
+        keys = [EmbeddingCache.key(model, text) for text in texts]
+        vectors = cache.get_many(keys)
+    except Exception as e:
+        ingest_log.warning(f"⚠️ Embedding cache unavailable: {e}")
+        return _embed_uncached(texts, batch_size, max_concurrency)
+    
+    # Embed each distinct missing text once
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            missing.setdefault(key, text)
+    if missing:
+        new_vectors = dict(zip(missing, _embed_uncached(list(missing.values()), batch_size, max_concurrency)))
+        try:
+            cache.put_many(new_vectors)
+        except Exception as e:
+            ingest_log.warning(f"⚠️ Failed to update embedding cache: {e}")
+        vectors.update(new_vectors)
+    
+    return [vectors[key] for key in keys]
+
+def _embed_uncached(texts: List[str], batch_size: int, max_concurrency: int) -> List[List[float]]:
+    """
+    Embed texts with one Ollama request per batch instead of one per text,
+    keeping several batch requests in flight at once.
+    
+    Args:
+        texts: Texts to embed
+        batch_size: Maximum number of texts sent in a single request
+        max_concurrency: Maximum number of batch requests in flight
+        
+    Returns:
+        Embedding vectors in the same order as the input texts
+    """
+    embeddings = get_embeddings()
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    if len(batches) <= 1:
+        return [vector for batch in batches for vector in embeddings.embed_documents(batch)]
+    
+    # The sync client is thread-safe; map() keeps results in input order
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+        return [
+            vector
+            for batch_vectors in executor.map(embeddings.embed_documents, batches)
+            for vector in batch_vectors
+        ]
@@ -1,8 +1,9 @@
-from langchain_chroma import Chroma
-from services.embeddings import ollama_embeddings
-from typing import Dict, List, Optional
+from services.chroma_client import get_vectorstore
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+import functools
 import os
-from collections import defaultdict
+import threading
+from collections import Counter, defaultdict
 
 class FileManager:
     """
@@ -11,29 +12,132 @@ class FileManager:
     """
     
     def __init__(self):
-        self.vectorstore = Chroma(
-            embedding_function=ollama_embeddings,
-            persist_directory="./db/chroma_db",
-            collection_name="confluence_knowledge_base"
-        )
+        self.vectorstore = get_vectorstore()
+        # Incremented on every add/remove/clear so callers can cache reads
+        self.db_version = 0
+        # Filenames present in the database, loaded once and kept in sync on add/remove
+        self._existing_filenames: Set[str] = set(self.list_all_files())
+        # Filenames currently being ingested by any session or worker thread
+        self._ingesting: Set[str] = set()
+        self._ingesting_lock = threading.Lock()
     
-    def file_exists_in_database(self, filename: str) -> bool:
+    def bump_version(self) -> int:
         """
-        Check if a file already exists in the database based on filename metadata.
+        Mark the database contents as changed.
+        
+        Returns:
+            The new database version
+        """
+        self.db_version += 1
+        return self.db_version
+    
+    def mark_file_added(self, filename: str):
+        """
+        Record that a file's documents were added to the database.
+        
+        Args:
+            filename: Name of the added file
+        """
+        self._existing_filenames.add(filename)
+        self.bump_version()
+    
+    def mark_file_removed(self, filename: str):
+        """
+        Record that a file's documents were removed from the database.
+        
+        Args:
+            filename: Name of the removed file
+        """
+        self._existing_filenames.discard(filename)
+        self.bump_version()
+    
+    def claim_for_ingestion(self, filename: str) -> bool:
+        """
+        Mark a file as being ingested, unless it is already stored or in flight.
+        
+        Args:
+            filename: Name of the file about to be ingested
+            
+        Returns:
+            True if the caller now owns the ingestion and must release it afterwards
+        """
+        with self._ingesting_lock:
+            if filename in self._ingesting or filename in self._existing_filenames:
+                return False
+            self._ingesting.add(filename)
+            return True
+    
+    def release_ingestion(self, filename: str):
+        """
+        Clear a claim taken with claim_for_ingestion.
+        
+        Args:
+            filename: Name of the file whose ingestion finished or was abandoned
+        """
+        with self._ingesting_lock:
+            self._ingesting.discard(filename)
+    
+    def is_being_ingested(self, filename: str) -> bool:
+        """
+        Check if a file is currently being ingested.
         
         Args:
             filename: Name of the file to check
             
         Returns:
-            True if file exists, False otherwise
+            True if a worker holds an ingestion claim for the file
+        """
+        return filename in self._ingesting
+    
+    def get_existing_filenames(self) -> Set[str]:
+        """
+        Get the set of filenames stored in the database.
+        Loaded once at startup and kept in sync on add/remove.
+        
+        Returns:
+            Set of filenames
         """
+        return self._existing_filenames
+    
+    def existing_filenames_in(self, names: Iterable[str]) -> Set[str]:
+        """
+        Check which of the given filenames are stored in the database with one query.
+        Also folds the result into the in-memory filename set, in case another
+        process added files since it was loaded.
+        
+        Args:
+            names: Filenames to check
+            
+        Returns:
+            Subset of names that exist in the database
+        """
+        names = list(names)
+        if not names:
+            return set()
         try:
-            # More efficient check using a where filter
-            results = self.vectorstore.get(where={"filename": filename}, limit=1)
-            return bool(results and results.get('ids'))
+            results = self.vectorstore.get(where={"filename": {"$in": names}}, include=["metadatas"])
+            existing = {
+                metadata['filename']
+                for metadata in results.get('metadatas') or []
+                if metadata and metadata.get('filename')
+            }
         except Exception as e:
             print(f"Error checking file existence: {e}")
-            return False
+            return {name for name in names if name in self._existing_filenames}
+        self._existing_filenames.update(existing)
+        return existing
+    
+    def file_exists_in_database(self, filename: str) -> bool:
+        """
+        Check if a file already exists in the database based on filename metadata.
+        
+        Args:
+            filename: Name of the file to check
+            
+        Returns:
+            True if file exists, False otherwise
+        """
+        return filename in self._existing_filenames
     
     def remove_documents_by_filename(self, filename: str) -> bool:
         """
@@ -48,26 +152,11 @@ class FileManager:
         try:
             print(f"Attempting to remove documents for file: {filename}")
             
-            # Check if the file exists first
-            if not self.file_exists_in_database(filename):
-                print(f"No documents found for file: {filename}")
-                return True # Or False, depending on desired behavior for non-existent files
-
-            # More efficient deletion using a where filter
-            ids_to_remove = self.vectorstore.get(where={"filename": filename})['ids']
-            if not ids_to_remove:
-                print(f"No document IDs found for file: {filename}")
-                return True
-
-            self.vectorstore._collection.delete(ids=ids_to_remove)
-            
-            # Verify removal
-            if not self.file_exists_in_database(filename):
-                print(f"✅ Successfully removed documents for file: {filename}")
-                return True
-            else:
-                print(f"❌ Removal verification failed for file: {filename}")
-                return False
+            # Let Chroma resolve the filter itself instead of round-tripping ids through Python
+            self.vectorstore._collection.delete(where={"filename": filename})
+            self.mark_file_removed(filename)
+            print(f"✅ Successfully removed documents for file: {filename}")
+            return True
                 
         except Exception as e:
             print(f"Error removing documents for file {filename}: {e}")
@@ -75,27 +164,36 @@ class FileManager:
             traceback.print_exc()
             return False
     
-    def clear_all_documents(self) -> bool:
+    def clear_all_documents(self, batch_size: int = 5000) -> bool:
         """
         Clear all documents from the database.
         
+        Args:
+            batch_size: Number of documents deleted per request
+        
         Returns:
             True if clearing was successful, False otherwise
         """
         try:
-            # Get all document IDs
-            collection = self.vectorstore.get()
-            if collection and 'ids' in collection and collection['ids']:
+            # O(1) emptiness check before paging through ids
+            if self.vectorstore._collection.count() == 0:
+                print("Database is already empty")
+                return True
+            
+            # Delete page by page so ids for the whole collection are never held at once
+            deleted_any = False
+            while True:
+                page = self.vectorstore.get(limit=batch_size, include=[])
+                if not page or not page.get('ids'):
+                    break
                 # Use the collection's delete method directly
-                self.vectorstore._collection.delete(ids=collection['ids'])
+                self.vectorstore._collection.delete(ids=page['ids'])
+                deleted_any = True
+            
+            if deleted_any:
+                self._existing_filenames.clear()
+                self.bump_version()
                 print("All documents cleared from database")
-                
-                # Verify the database is actually empty
-                verification_collection = self.vectorstore.get(limit=1)
-                if verification_collection and verification_collection.get('ids'):
-                    print("Warning: Database may not be completely cleared")
-                    return False
-                
                 return True
             else:
                 print("Database is already empty")
@@ -104,6 +202,53 @@ class FileManager:
             print(f"Error clearing database: {e}")
             return False
     
+    def _iter_metadata_pages(self, batch_size: int = 5000) -> Iterator[List[Optional[Dict]]]:
+        """
+        Stream chunk metadatas from the collection one page at a time.
+        
+        Args:
+            batch_size: Number of chunks fetched per request
+            
+        Yields:
+            Lists of metadata dicts (None for chunks without metadata)
+        """
+        offset = 0
+        while True:
+            page = self.vectorstore.get(limit=batch_size, offset=offset, include=["metadatas"])
+            ids = page.get('ids') if page else None
+            if not ids:
+                return
+            yield page.get('metadatas') or [None] * len(ids)
+            if len(ids) < batch_size:
+                return
+            offset += batch_size
+    
+    def _scan_metadatas(self, with_sources: bool = False) -> Tuple[int, Dict[Optional[str], int], Dict[Optional[str], Set[str]]]:
+        """
+        Aggregate chunk metadata without fetching embeddings or documents.
+        
+        Args:
+            with_sources: Also collect the sources per filename
+            
+        Returns:
+            Tuple of (total chunk count, chunk count per filename, sources per filename).
+            Chunks without a filename are keyed under None.
+        """
+        total = 0
+        file_counts = Counter()
+        file_sources = defaultdict(set)
+        
+        # Aggregate page by page so peak memory stays bounded by the page size
+        for metadatas in self._iter_metadata_pages():
+            total += len(metadatas)
+            file_counts.update(metadata.get('filename') for metadata in metadatas if metadata)
+            if with_sources:
+                for metadata in metadatas:
+                    if metadata and metadata.get('source'):
+                        file_sources[metadata.get('filename')].add(metadata.get('source'))
+        
+        return total, file_counts, file_sources
+    
     def get_database_statistics(self) -> Dict:
         """
         Get detailed statistics about the database contents.
@@ -112,31 +257,17 @@ class FileManager:
             Dictionary containing database statistics
         """
         try:
-            collection = self.vectorstore.get()
-            if not collection or 'metadatas' not in collection:
-                return {
-                    'total_documents': 0,
-                    'unique_files': 0,
-                    'files_breakdown': {}
-                }
-            
-            # Count documents per file
-            file_counts = defaultdict(int)
-            for metadata in collection['metadatas']:
-                if metadata:
-                    filename = metadata.get('filename', 'unknown')
-                    file_counts[filename] += 1
-            
-            # Create files breakdown
+            total_documents, file_counts, _ = self._scan_metadatas()
+            
+            # Create files breakdown, grouping chunks without a filename as 'unknown'
             files_breakdown = {}
             for filename, count in file_counts.items():
-                files_breakdown[filename] = {
-                    'chunk_count': count
-                }
+                key = 'unknown' if filename is None else filename
+                files_breakdown.setdefault(key, {'chunk_count': 0})['chunk_count'] += count
             
             return {
-                'total_documents': len(collection['ids']),
-                'unique_files': len(file_counts),
+                'total_documents': total_documents,
+                'unique_files': len(files_breakdown),
                 'files_breakdown': files_breakdown
             }
             
@@ -156,13 +287,14 @@ class FileManager:
             Dictionary with debug information
         """
         try:
-            collection = self.vectorstore.get()
+            # Only the first few entries are shown, so fetch just those
+            collection = self.vectorstore.get(limit=5, include=["metadatas"])
             
             debug_info = {
                 'has_collection': collection is not None,
                 'has_ids': 'ids' in collection if collection else False,
                 'has_metadatas': 'metadatas' in collection if collection else False,
-                'total_documents': len(collection['ids']) if collection and 'ids' in collection else 0,
+                'total_documents': self.vectorstore._collection.count(),
                 'sample_metadata': []
             }
             
@@ -195,16 +327,8 @@ class FileManager:
             List of filenames
         """
         try:
-            collection = self.vectorstore.get()
-            if not collection or 'metadatas' not in collection:
-                return []
-            
-            filenames = set()
-            for metadata in collection['metadatas']:
-                if metadata and metadata.get('filename'):
-                    filenames.add(metadata.get('filename'))
-            
-            return sorted(list(filenames))
+            _, file_counts, _ = self._scan_metadatas()
+            return sorted(filename for filename in file_counts if filename)
             
         except Exception as e:
             print(f"Error listing files: {e}")
@@ -221,31 +345,22 @@ class FileManager:
             Dictionary with file information or None if not found
         """
         try:
-            collection = self.vectorstore.get()
-            if not collection or 'metadatas' not in collection:
-                return None
-            
-            chunk_count = 0
-            sources = set()
-            
-            for metadata in collection['metadatas']:
-                if metadata and metadata.get('filename') == filename:
-                    chunk_count += 1
-                    if metadata.get('source'):
-                        sources.add(metadata.get('source'))
-            
+            _, file_counts, file_sources = self._scan_metadatas(with_sources=True)
+            chunk_count = file_counts.get(filename, 0)
             if chunk_count == 0:
                 return None
             
             return {
                 'filename': filename,
                 'chunk_count': chunk_count,
-                'sources': list(sources)
+                'sources': list(file_sources.get(filename, set()))
             }
             
         except Exception as e:
             print(f"Error getting file info for {filename}: {e}")
             return None
 
-# Create a singleton instance
-file_manager = FileManager()
+@functools.lru_cache(maxsize=None)
+def get_file_manager() -> FileManager:
+    """Get the shared FileManager, opening the database on first use."""
+    return FileManager()
@@ -3,15 +3,18 @@ File processing service for handling file uploads and processing.
 Implements best practices for file handling and state management.
 """
 
+import hashlib
 import os
-import tempfile
-from typing import List, Dict, Optional, Callable
-from dataclasses import dataclass
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Iterable, Optional, Callable, Set
+from dataclasses import dataclass, field
 from enum import Enum
 import streamlit as st
 from services.qa_pipeline import process_uploaded_files
-from services.file_manager import file_manager
-from config import PROCESSING_DELAY_SECONDS, get_status_message, get_error_message
+from services.file_manager import get_file_manager
+from services.ingest_logging import ingest_log
+from config import MAX_FILE_SIZE_MB, MAX_PROCESSING_WORKERS, get_status_message, get_error_message
 
 
 class ProcessingStatus(Enum):
@@ -24,7 +27,33 @@ class ProcessingStatus(Enum):
     ERROR = "error"
 
 
-@dataclass
+# Statuses in which files are still being worked on
+ACTIVE_STATUSES = frozenset({ProcessingStatus.STARTING, ProcessingStatus.PROCESSING})
+
+
+class WantedFiles:
+    """Lock-guarded set of filenames still wanted, shared between the script and worker threads"""
+    
+    def __init__(self, names: Iterable[str] = ()):
+        self._names: Set[str] = set(names)
+        self._lock = threading.Lock()
+    
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._names
+    
+    def discard(self, names: Iterable[str]):
+        """Stop wanting the given files"""
+        with self._lock:
+            self._names.difference_update(names)
+    
+    def clear(self):
+        """Stop wanting every file"""
+        with self._lock:
+            self._names.clear()
+
+
+@dataclass(slots=True)
 class ProcessingState:
     """State of file processing"""
     status: ProcessingStatus = ProcessingStatus.IDLE
@@ -33,11 +62,11 @@ class ProcessingState:
     current_filename: Optional[str] = None
     progress: float = 0.0
     message: str = ""
-    files_to_process: List[str] = None
-    
-    def __post_init__(self):
-        if self.files_to_process is None:
-            self.files_to_process = []
+    files_to_process: List[str] = field(default_factory=list)
+    files_to_process_set: Set[str] = field(default_factory=set)  # Mirrors files_to_process for O(1) membership
+    file_digests: Dict[str, str] = field(default_factory=dict)
+    # Live view for worker threads; removals and cancellation take effect immediately
+    wanted_files: WantedFiles = field(default_factory=WantedFiles)
 
 
 class FileProcessor:
@@ -45,35 +74,66 @@ class FileProcessor:
     
     def __init__(self):
         self.state_key = "file_processor_state"
+        self.processed_key = "processed_files"
         self._ensure_state()
     
     def _ensure_state(self):
         """Ensure processing state exists in session state"""
         if self.state_key not in st.session_state:
             st.session_state[self.state_key] = ProcessingState()
+        if self.processed_key not in st.session_state:
+            # Maps content digest -> filename of every file ingested this session
+            st.session_state[self.processed_key] = {}
+    
+    @staticmethod
+    def _file_digest(file_obj) -> str:
+        """Compute the SHA-256 digest of an uploaded file's content"""
+        return hashlib.sha256(file_obj.getbuffer()).hexdigest()
+    
+    def _is_duplicate_content(self, digest: str) -> bool:
+        """Check if identical content was already ingested under any filename"""
+        self._ensure_state()
+        known_filename = st.session_state[self.processed_key].get(digest)
+        # The recorded file may have been removed from the database since
+        return known_filename is not None and known_filename in get_file_manager().get_existing_filenames()
     
     @property
     def state(self) -> ProcessingState:
         """Get current processing state"""
-        self._ensure_state()
-        return st.session_state[self.state_key]
+        try:
+            return st.session_state[self.state_key]
+        except KeyError:
+            # Slow path only on a session's first access
+            self._ensure_state()
+            return st.session_state[self.state_key]
     
     def _update_state(self, **kwargs):
         """Update processing state"""
+        state = self.state
         for key, value in kwargs.items():
-            setattr(self.state, key, value)
+            setattr(state, key, value)
     
     def is_processing(self) -> bool:
         """Check if currently processing files"""
-        return self.state.status in [ProcessingStatus.STARTING, ProcessingStatus.PROCESSING]
+        return self.state.status in ACTIVE_STATUSES
     
     from typing import Tuple
     def start_processing(self, uploaded_files: List) -> Tuple[bool, str]:
         """Start processing uploaded files"""
         if self.is_processing():
             return False, "Processing already in progress"
-        # Filter out files that already exist in database
-        new_files = [f for f in uploaded_files if not file_manager.file_exists_in_database(f.name)]
+        # Filter out files that already exist in database, by name or by content
+        existing_filenames = get_file_manager().existing_filenames_in(f.name for f in uploaded_files)
+        new_files = []
+        file_digests = {}
+        for f in uploaded_files:
+            if f.name in existing_filenames:
+                continue
+            digest = self._file_digest(f)
+            if self._is_duplicate_content(digest):
+                continue
+            new_files.append(f)
+            file_digests[f.name] = digest
         if not new_files:
             return False, "All selected files are already in the database"
         # Initialize processing state
@@ -82,6 +142,9 @@ class FileProcessor:
             current_file_index=0,
             total_files=len(new_files),
             files_to_process=[f.name for f in new_files],
+            files_to_process_set={f.name for f in new_files},
+            file_digests=file_digests,
+            wanted_files=WantedFiles(f.name for f in new_files),
             progress=0.0,
             message=get_status_message("starting")
         )
@@ -89,68 +152,102 @@ class FileProcessor:
     
     def cancel_processing(self, reason: str = "Processing cancelled") -> str:
         """Cancel current processing"""
+        # Workers still running check this set before every stage
+        self.state.wanted_files.clear()
         self._update_state(
             status=ProcessingStatus.CANCELLED,
             message=reason
         )
         return reason
     
-    def process_next_file(self, uploaded_files: List) -> bool:
-        """Process the next file in the queue"""
+    def process_all(self, uploaded_files: List,
+                    on_progress: Optional[Callable[[float, str], None]] = None) -> bool:
+        """
+        Process every queued file in a single call.
+        
+        Args:
+            uploaded_files: Currently uploaded file objects
+            on_progress: Optional callback receiving (progress, message) updates
+            
+        Returns:
+            True if processing completed, False if it was cancelled or never started
+        """
         if not self.is_processing():
-            return False
+            return self.state.status == ProcessingStatus.COMPLETED
         
-        # Check if we have more files to process
-        if self.state.current_file_index >= len(self.state.files_to_process):
-            self._complete_processing()
-            return False
+        state = self.state
+        # Built per call: the processor is shared by all sessions, so it must not hold uploads
+        uploaded_by_name = {f.name: f for f in uploaded_files} if uploaded_files else {}
         
-        filename = self.state.files_to_process[self.state.current_file_index]
+        # Drop files that no longer need processing before dispatching the rest.
+        # Files finish out of order, so an interrupted run restarts from the full
+        # queue and skips whatever already reached the database or is still being
+        # ingested by workers from the interrupted run.
+        self._update_state(current_file_index=0)
+        to_process = []
+        for filename in state.files_to_process:
+            if self._should_process_file(filename, uploaded_by_name):
+                to_process.append(filename)
+            else:
+                self._skip_current_file(f"Skipped {filename}")
         
-        # Update progress
-        progress = (self.state.current_file_index + 1) / self.state.total_files
         self._update_state(
             status=ProcessingStatus.PROCESSING,
-            current_filename=filename,
-            progress=progress,
-            message=get_status_message("processing", 
-                                     filename=filename, 
-                                     current=self.state.current_file_index + 1, 
-                                     total=self.state.total_files)
+            progress=state.current_file_index / state.total_files if state.total_files else 0.0,
+            message=get_status_message("starting")
         )
+        if on_progress:
+            on_progress(state.progress, state.message)
         
-        # Validate file still exists and should be processed
-        if not self._should_process_file(filename, uploaded_files):
-            self._skip_current_file(f"Skipped {filename}")
-            return True
+        # Worker threads have no access to session state, so they get the live wanted set;
+        # update_files_list and cancel_processing shrink it while workers run
+        file_manager = get_file_manager()
+        wanted_files = state.wanted_files
+        def cancellation_callback(fname):
+            return fname in wanted_files and fname not in file_manager.get_existing_filenames()
         
-        # Process the file
-        success = self._process_single_file(filename, uploaded_files)
-        
-        # Update status based on result
-        if success:
-            self._update_state(message=f"✅ Processed {filename}")
-        else:
-            self._update_state(message=f"❌ Failed to process {filename}")
-        
-        # Move to next file
-        self._update_state(current_file_index=self.state.current_file_index + 1)
+        executor = ThreadPoolExecutor(max_workers=MAX_PROCESSING_WORKERS)
+        try:
+            futures = {
+                executor.submit(self._ingest_file, uploaded_by_name[filename], cancellation_callback): filename
+                for filename in to_process
+            }
+            # Progress is reported from this thread as files finish, in any order
+            for future in as_completed(futures):
+                filename = futures[future]
+                success = future.result()
+                if success:
+                    self._remember_digest(filename)
+                done = state.current_file_index + 1
+                self._update_state(
+                    current_file_index=done,
+                    current_filename=filename,
+                    progress=done / state.total_files,
+                    message=f"✅ Processed {filename}" if success else f"❌ Failed to process {filename}"
+                )
+                if on_progress:
+                    on_progress(state.progress, state.message)
+        finally:
+            # If the script run is interrupted, don't start files that haven't begun
+            executor.shutdown(wait=False, cancel_futures=True)
         
+        self._complete_processing()
         return True
     
-    def _should_process_file(self, filename: str, uploaded_files: List) -> bool:
+    def _should_process_file(self, filename: str, uploaded_by_name: Dict) -> bool:
         """Check if file should be processed"""
-        # Check if file already exists in database
-        if file_manager.file_exists_in_database(filename):
+        # Check if file already exists in database, or is still being ingested
+        # by workers left running from an interrupted script run
+        file_manager = get_file_manager()
+        if filename in file_manager.get_existing_filenames() or file_manager.is_being_ingested(filename):
             return False
         
         # Check if file is still in uploaded files
-        uploaded_names = [f.name for f in uploaded_files] if uploaded_files else []
-        if filename not in uploaded_names:
+        if filename not in uploaded_by_name:
             return False
         
         # Check if file is still in processing queue
-        if filename not in self.state.files_to_process:
+        if filename not in self.state.files_to_process_set:
             return False
         
         return True
@@ -163,49 +260,37 @@ class FileProcessor:
         )
         return reason
     
-    def _process_single_file(self, filename: str, uploaded_files: List) -> bool:
-        """Process a single file"""
+    def _remember_digest(self, filename: str):
+        """Remember a processed file's content so identical re-uploads are skipped"""
+        digest = self.state.file_digests.get(filename)
+        if digest:
+            st.session_state[self.processed_key][digest] = filename
+    
+    @staticmethod
+    def _ingest_file(file_obj, cancellation_callback: Callable[[str], bool]) -> bool:
+        """Load, split and store one uploaded file; safe to run off the script thread"""
+        name = file_obj.name
         try:
-            # Find the file object
-            file_obj = None
-            for f in uploaded_files:
-                if f.name == filename:
-                    file_obj = f
-                    break
-            
-            if file_obj is None:
+            # Reject oversized files before doing any work on them
+            if file_obj.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                ingest_log.error(f"❌ {name}: {get_error_message('file_too_large', size=MAX_FILE_SIZE_MB)}")
                 return False
             
-            # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(
-                suffix=os.path.splitext(file_obj.name)[1],
-                delete=False
-            )
-            temp_file.write(file_obj.getvalue())
-            temp_file.close()
+            ext = os.path.splitext(name)[1].lower()
             
-            temp_file_info = {
-                'path': temp_file.name,
-                'name': file_obj.name,
-                'ext': os.path.splitext(file_obj.name)[1].lower()
+            # Uploads are already in memory, so hand the bytes over instead of a temp file
+            file_info = {
+                'content': file_obj.getvalue(),
+                'name': name,
+                'ext': ext
             }
             
-            # Create cancellation callback
-            def cancellation_callback(fname):
-                return self._should_process_file(fname, uploaded_files)
-            
             # Process file
-            success = process_uploaded_files([temp_file_info], cancellation_callback)
-            
-            return success
+            return process_uploaded_files([file_info], cancellation_callback)
             
         except Exception as e:
-            print(f"❌ Error processing file {filename}: {e}")
+            ingest_log.error(f"❌ Error processing file {name}: {e}")
             return False
-        finally:
-            # Clean up temp file
-            if 'temp_file' in locals() and os.path.exists(temp_file.name):
-                os.unlink(temp_file.name)
     
     def _complete_processing(self) -> str:
         """Complete processing"""
@@ -225,27 +310,34 @@ class FileProcessor:
             current_filename=None,
             progress=0.0,
             message="",
-            files_to_process=[]
+            files_to_process=[],
+            files_to_process_set=set(),
+            file_digests={},
+            wanted_files=WantedFiles()
         )
     
     def update_files_list(self, uploaded_files: List) -> Optional[str]:
         """Update the list of files being processed when files are removed"""
         if not self.is_processing():
             return None
-        current_uploaded_names = [f.name for f in uploaded_files] if uploaded_files else []
+        state = self.state
+        current_uploaded_names = {f.name for f in uploaded_files} if uploaded_files else set()
         # Find files that were removed
-        removed_files = [f for f in self.state.files_to_process if f not in current_uploaded_names]
+        removed_files = state.files_to_process_set - current_uploaded_names
         if removed_files:
+            # Let running workers drop removed files before they are stored
+            state.wanted_files.discard(removed_files)
             # Update the processing list
-            new_files_to_process = [f for f in self.state.files_to_process if f in current_uploaded_names]
+            new_files_to_process = [f for f in state.files_to_process if f in current_uploaded_names]
             if not new_files_to_process:
                 # All files were removed
                 self.cancel_processing("Processing cancelled - all files removed")
                 return f"Cancelled processing for {len(removed_files)} file(s)"
             # Update state
-            old_current_filename = self.state.current_filename
+            old_current_filename = state.current_filename
             self._update_state(
                 files_to_process=new_files_to_process,
+                files_to_process_set=set(new_files_to_process),
                 total_files=len(new_files_to_process)
             )
             # Adjust current file index
@@ -254,7 +346,7 @@ class FileProcessor:
                 self._update_state(current_file_index=new_index)
             else:
                 # Current file was removed, adjust index
-                if self.state.current_file_index >= len(new_files_to_process):
+                if state.current_file_index >= len(new_files_to_process):
                     self._update_state(current_file_index=max(0, len(new_files_to_process) - 1))
             return f"Cancelled processing for {len(removed_files)} file(s)"
         return None
@@ -266,5 +358,7 @@ class FileProcessor:
         return None, None
 
 
-# Create singleton instance
-file_processor = FileProcessor()
+@st.cache_resource
+def get_file_processor() -> FileProcessor:
+    """Get the shared FileProcessor; its processing state lives in each session."""
+    return FileProcessor()
@@ -0,0 +1,18 @@
+"""
+Queued logger for ingestion progress.
+Records are written to stdout by a background listener, so worker threads never block on it.
+"""
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+ingest_log = logging.getLogger("ingest")
+if not ingest_log.handlers:
+    _ingest_log_queue = queue.SimpleQueue()
+    _ingest_log_handler = logging.StreamHandler(sys.stdout)
+    _ingest_log_handler.setFormatter(logging.Formatter("%(message)s"))
+    ingest_log.addHandler(QueueHandler(_ingest_log_queue))
+    ingest_log.setLevel(logging.INFO)
+    ingest_log.propagate = False
+    QueueListener(_ingest_log_queue, _ingest_log_handler).start()
@@ -1,133 +1,28 @@
-from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.prompts import PromptTemplate
-from services.embeddings import ollama_embeddings
-from services.llm import OllamaLLM
+from langchain_core.documents import Document
+from services.document_loader import split_documents, load_and_split, estimate_tokens
+from services.embeddings import embed_batch, embed_query_cached
+from services.chroma_client import get_vectorstore
+from services.llm import make_llm
 from services.conversation_manager import conversation_manager
-from services.file_manager import file_manager
-from typing import List, Dict, Tuple
+from services.file_manager import get_file_manager
+from services.ingest_logging import ingest_log
+from config import DB_ADD_BATCH_SIZE, MAX_PROCESSING_WORKERS, MAX_RETRIEVED_CONTEXT_TOKENS
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Tuple, Iterator
+import functools
+import multiprocessing
+import threading
 import os
+import uuid
 
-vectorstore = Chroma(
-    embedding_function=ollama_embeddings,
-    persist_directory="./db/chroma_db",
-    collection_name="confluence_knowledge_base"
-)
-
-llm = OllamaLLM(model_name="llama3.1:latest")
+vectorstore = get_vectorstore()
 
-def get_dynamic_text_splitter(text_length: int) -> RecursiveCharacterTextSplitter:
-    """
-    Create a text splitter with dynamic parameters based on text length.
-    
-    Args:
-        text_length: Total length of the text to be split
-        
-    Returns:
-        RecursiveCharacterTextSplitter with optimized parameters
-    """
-    if text_length <= 5000:
-        # Small documents: smaller chunks for better granularity
-        chunk_size = 500
-        chunk_overlap = 100
-    elif text_length <= 20000:
-        # Medium documents: standard chunks
-        chunk_size = 1000
-        chunk_overlap = 200
-    elif text_length <= 50000:
-        # Large documents: larger chunks for better context
-        chunk_size = 1500
-        chunk_overlap = 300
-    else:
-        # Very large documents: even larger chunks
-        chunk_size = 2000
-        chunk_overlap = 400
-    
-    return RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-
-def analyze_document_content(docs) -> Dict[str, any]:
-    """
-    Analyze document content to determine optimal splitting strategy.
-    
-    Args:
-        docs: List of document objects
-        
-    Returns:
-        Dictionary with content analysis results
-    """
-    total_length = sum(len(doc.page_content) for doc in docs)
-    avg_page_length = total_length / len(docs) if docs else 0
-    
-    # Analyze content structure
-    newline_density = sum(doc.page_content.count('\n') for doc in docs) / total_length if total_length > 0 else 0
-    paragraph_density = sum(doc.page_content.count('\n\n') for doc in docs) / total_length if total_length > 0 else 0
-    
-    content_type = "structured" if paragraph_density > 0.01 else "continuous"
-    
-    return {
-        "total_length": total_length,
-        "avg_page_length": avg_page_length,
-        "newline_density": newline_density,
-        "paragraph_density": paragraph_density,
-        "content_type": content_type,
-        "num_pages": len(docs)
-    }
-
-def get_optimized_text_splitter(docs) -> Tuple[RecursiveCharacterTextSplitter, int]:
-    """
-    Get an optimized text splitter based on document analysis.
-    
-    Args:
-        docs: List of document objects
-        
-    Returns:
-        Tuple of (RecursiveCharacterTextSplitter, chunk_size) with optimized parameters
-    """
-    analysis = analyze_document_content(docs)
-    
-    # Base parameters from dynamic splitting
-    base_splitter = get_dynamic_text_splitter(analysis["total_length"])
-    
-    # Get chunk size and overlap from the base splitter
-    try:
-        base_chunk_size = base_splitter._chunk_size
-        base_overlap = base_splitter._chunk_overlap
-    except AttributeError:
-        # Fallback to default values if attributes aren't available
-        if analysis["total_length"] <= 5000:
-            base_chunk_size, base_overlap = 500, 100
-        elif analysis["total_length"] <= 20000:
-            base_chunk_size, base_overlap = 1000, 200
-        elif analysis["total_length"] <= 50000:
-            base_chunk_size, base_overlap = 1500, 300
-        else:
-            base_chunk_size, base_overlap = 2000, 400
-    
-    # Adjust based on content structure
-    if analysis["content_type"] == "structured":
-        # For structured content, prioritize paragraph breaks
-        separators = ["\n\n", "\n", ". ", " ", ""]
-        # Slightly smaller chunks for structured content
-        chunk_size = int(base_chunk_size * 0.9)
-    else:
-        # For continuous content, use standard separators
-        separators = ["\n\n", "\n", " ", ""]
-        chunk_size = base_chunk_size
-    
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=base_overlap,
-        length_function=len,
-        separators=separators
-    )
-    
-    return splitter, chunk_size
+llm = make_llm(model_name="llama3.1:latest")
 
 # Default text splitter for backward compatibility
 text_splitter = RecursiveCharacterTextSplitter(
@@ -150,6 +45,42 @@ Provide a clear, helpful answer. If you don't have enough information, say so. K
 Answer:"""
 )
 
+# The QA template is fixed and fully specified per query, so render it with plain
+# str.format and skip PromptTemplate's per-call validation
+_render_qa_prompt = CONVERSATIONAL_QA_PROMPT.template.format
+
+# Prompt used to fold older messages into a cumulative conversation summary
+CONVERSATION_SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["previous_summary", "transcript"],
+    template="""Summarize the key facts, questions and decisions of the conversation below in at most 200 tokens.
+Extend the existing summary rather than replacing it.
+
+Existing summary:
+{previous_summary}
+
+Conversation:
+{transcript}
+
+Summary:"""
+)
+
+def summarize_conversation(transcript: str, previous_summary: str = "") -> str:
+    """
+    Summarize older conversation messages, extending any previous summary.
+    
+    Args:
+        transcript: Formatted messages that are leaving the history window
+        previous_summary: Summary produced the last time messages rolled off
+        
+    Returns:
+        The updated cumulative summary
+    """
+    prompt = CONVERSATION_SUMMARY_PROMPT.format(
+        previous_summary=previous_summary or "None",
+        transcript=transcript
+    )
+    return llm.invoke(prompt)
+
 def format_chat_history(history: List[Dict[str, str]]) -> str:
     """Format chat history for inclusion in prompt using conversation manager."""
     formatted_history = conversation_manager.format_history_for_llm(history)
@@ -161,50 +92,92 @@ def format_chat_history(history: List[Dict[str, str]]) -> str:
     # Add a natural prefix for conversation context
     return f"Previous conversation:\n{formatted_history}\n"
 
-def get_chunk_statistics(chunks) -> Dict[str, any]:
+@functools.lru_cache(maxsize=1)
+def get_process_pool() -> ProcessPoolExecutor:
+    """Get the shared worker processes used to parse and split uploads off the GIL."""
+    # Spawn rather than fork: the parent holds Chroma and Streamlit threads
+    return ProcessPoolExecutor(
+        max_workers=min(MAX_PROCESSING_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+def load_and_split_in_worker(content: bytes, name: str, ext: str):
     """
-    Get statistics about the generated chunks.
+    Run load_and_split in the process pool, falling back to this process if the pool is unusable.
     
     Args:
-        chunks: List of text chunks
+        content: Raw file bytes
+        name: Original filename
+        ext: Lowercase file extension including the dot
         
     Returns:
-        Dictionary with chunk statistics
+        Same tuple as load_and_split
+    """
+    try:
+        return get_process_pool().submit(load_and_split, content, name, ext).result()
+    except BrokenProcessPool as e:
+        ingest_log.warning(f"⚠️ Worker process pool unavailable, splitting {name} in-process: {e}")
+        get_process_pool.cache_clear()
+        return load_and_split(content, name, ext)
+
+def add_documents_in_slabs(documents: List[Document], slab_size: int = DB_ADD_BATCH_SIZE):
     """
-    if not chunks:
-        return {"count": 0, "avg_length": 0, "min_length": 0, "max_length": 0}
+    Embed and store documents in large fixed-size slabs.
     
-    lengths = [len(chunk.page_content) for chunk in chunks]
+    Args:
+        documents: Chunks to add to the vector store
+        slab_size: Maximum number of chunks per collection.add call
+    """
+    # Never exceed the largest batch the Chroma client accepts in one call
+    try:
+        slab_size = min(slab_size, vectorstore._client.get_max_batch_size())
+    except Exception:
+        pass
     
-    return {
-        "count": len(chunks),
-        "avg_length": sum(lengths) / len(lengths),
-        "min_length": min(lengths),
-        "max_length": max(lengths),
-        "total_length": sum(lengths)
-    }
+    for start in range(0, len(documents), slab_size):
+        slab = documents[start:start + slab_size]
+        texts = [doc.page_content for doc in slab]
+        vectorstore._collection.add(
+            ids=[uuid.uuid4().hex for _ in slab],
+            embeddings=embed_batch(texts),
+            documents=texts,
+            metadatas=[doc.metadata for doc in slab]
+        )
 
 def process_uploaded_files(files, cancellation_callback=None):
-    from services.file_manager import file_manager  # Import here to avoid circular import
+    file_manager = get_file_manager()
+    claimed = []
+    try:
+        return _ingest_claimed_files(files, cancellation_callback, file_manager, claimed)
+    finally:
+        # Release claims only once the chunks are stored (or abandoned)
+        for filename in claimed:
+            file_manager.release_ingestion(filename)
+
+def _ingest_claimed_files(files, cancellation_callback, file_manager, claimed: List[str]):
     documents = []
     file_stats = []
     
     for file_info in files:
         # Check if processing should be cancelled for this specific file
         if cancellation_callback and not cancellation_callback(file_info['name']):
-            print(f"⚠️ Processing cancelled for {file_info['name']} - file removed")
+            ingest_log.warning(f"⚠️ Processing cancelled for {file_info['name']} - file removed")
             continue
             
-        # Check if file already exists in database
-        if file_manager.file_exists_in_database(file_info['name']):
-            print(f"⚠️ Skipping {file_info['name']} - already exists in database")
+        # Skip files already in the database or being ingested by another worker
+        if not file_manager.claim_for_ingestion(file_info['name']):
+            ingest_log.warning(f"⚠️ Skipping {file_info['name']} - already exists in database or is being processed")
             continue
+        claimed.append(file_info['name'])
             
-        file_path = file_info['path']
+        file_path = file_info.get('path')
         file_ext = file_info['ext']
         
         try:
-            if file_ext == '.pdf':
+            if 'content' in file_info and file_ext in ('.pdf', '.txt'):
+                # In-memory upload, loaded directly without a temporary file
+                loader = None
+            elif file_ext == '.pdf':
                 loader = PyPDFLoader(file_path)
             elif file_ext == '.txt':
                 loader = TextLoader(file_path, encoding='utf-8')
@@ -213,66 +186,60 @@ def process_uploaded_files(files, cancellation_callback=None):
                 
             # Check cancellation before loading
             if cancellation_callback and not cancellation_callback(file_info['name']):
-                print(f"⚠️ Processing cancelled for {file_info['name']} - file removed before loading")
+                ingest_log.warning(f"⚠️ Processing cancelled for {file_info['name']} - file removed before loading")
                 continue
                 
-            docs = loader.load()
+            if loader is None:
+                # Parsing and splitting are CPU-bound, so run them in a worker process
+                num_pages, split_docs, analysis, chunk_stats, chunk_size = load_and_split_in_worker(
+                    file_info['content'], file_info['name'], file_ext
+                )
+            else:
+                docs = loader.load()
+                num_pages = len(docs)
+                # Use optimized text splitter based on document analysis
+                split_docs, analysis, chunk_stats, chunk_size = split_documents(docs)
             
-            # Check cancellation after loading
+            # Check cancellation after loading and splitting
             if cancellation_callback and not cancellation_callback(file_info['name']):
-                print(f"⚠️ Processing cancelled for {file_info['name']} - file removed during loading")
+                ingest_log.warning(f"⚠️ Processing cancelled for {file_info['name']} - file removed during loading")
                 continue
             
             # Final check before processing to ensure no duplicates
-            if file_manager.file_exists_in_database(file_info['name']):
-                print(f"⚠️ Skipping {file_info['name']} - added to database during processing")
-                continue
-            
-            # Check cancellation before text splitting
-            if cancellation_callback and not cancellation_callback(file_info['name']):
-                print(f"⚠️ Processing cancelled for {file_info['name']} - file removed before text splitting")
+            if file_info['name'] in file_manager.get_existing_filenames():
+                ingest_log.warning(f"⚠️ Skipping {file_info['name']} - added to database during processing")
                 continue
             
-            # Use optimized text splitter based on document analysis
-            optimized_splitter, chunk_size = get_optimized_text_splitter(docs)
-            split_docs = optimized_splitter.split_documents(docs)
-            
-            # Check cancellation after text splitting
-            if cancellation_callback and not cancellation_callback(file_info['name']):
-                print(f"⚠️ Processing cancelled for {file_info['name']} - file removed after text splitting")
-                continue
-            
-            # Add filename metadata to all document chunks
+            # Add filename and token count metadata to all document chunks
             for doc in split_docs:
                 doc.metadata['filename'] = file_info['name']
+                doc.metadata['token_count'] = estimate_tokens(doc.page_content)
             
             # Final cancellation check before adding to documents
             if cancellation_callback and not cancellation_callback(file_info['name']):
-                print(f"⚠️ Processing cancelled for {file_info['name']} - file removed before adding to vector store")
+                ingest_log.warning(f"⚠️ Processing cancelled for {file_info['name']} - file removed before adding to vector store")
                 continue
             
             documents.extend(split_docs)
             
-            # Get detailed statistics
-            analysis = analyze_document_content(docs)
-            chunk_stats = get_chunk_statistics(split_docs)
-            
             file_stats.append({
                 "name": file_info['name'],
-                "pages": len(docs),
+                "pages": num_pages,
                 "chunks": len(split_docs),
                 "analysis": analysis,
                 "chunk_stats": chunk_stats,
                 "chunk_size": chunk_size
             })
             
-            print(f"📄 {file_info['name']}: {len(docs)} pages → {len(split_docs)} chunks")
-            print(f"   Text: {analysis['total_length']:,} chars, Type: {analysis['content_type']}")
-            print(f"   Chunks: avg {chunk_stats['avg_length']:.0f} chars, "
-                  f"range {chunk_stats['min_length']}-{chunk_stats['max_length']}")
+            ingest_log.info(
+                f"📄 {file_info['name']}: {num_pages} pages → {len(split_docs)} chunks\n"
+                f"   Text: {analysis['total_length']:,} chars, Type: {analysis['content_type']}\n"
+                f"   Chunks: avg {chunk_stats['avg_length']:.0f} chars, "
+                f"range {chunk_stats['min_length']}-{chunk_stats['max_length']}"
+            )
             
         except Exception as e:
-            print(f"❌ Error processing file {file_info['name']}: {e}")
+            ingest_log.error(f"❌ Error processing file {file_info['name']}: {e}")
             continue
     
     if documents:
@@ -286,7 +253,7 @@ def process_uploaded_files(files, cancellation_callback=None):
                     final_documents.append(doc)
                 else:
                     if filename:
-                        print(f"ℹ️ Filtering out chunks for cancelled file: {filename}")
+                        ingest_log.info(f"ℹ️ Filtering out chunks for cancelled file: {filename}")
             
             # Filter file stats to match remaining documents
             remaining_filenames = set(doc.metadata.get('filename') for doc in final_documents)
@@ -296,99 +263,159 @@ def process_uploaded_files(files, cancellation_callback=None):
         
         if documents:
             try:
-                vectorstore.add_documents(documents)
+                # Embed in fixed-size batches, then store the precomputed vectors
+                add_documents_in_slabs(documents)
+                for filename in {doc.metadata['filename'] for doc in documents}:
+                    file_manager.mark_file_added(filename)
                 
                 # Print summary statistics
                 total_chunks = len(documents)
                 total_files = len(file_stats)
                 avg_chunks_per_file = total_chunks / total_files if total_files > 0 else 0
                 
-                print(f"\n📊 Processing Summary:")
-                print(f"   Files processed: {total_files}")
-                print(f"   Total chunks added: {total_chunks}")
-                print(f"   Avg chunks per file: {avg_chunks_per_file:.2f}")
+                ingest_log.info(
+                    f"\n📊 Processing Summary:\n"
+                    f"   Files processed: {total_files}\n"
+                    f"   Total chunks added: {total_chunks}\n"
+                    f"   Avg chunks per file: {avg_chunks_per_file:.2f}"
+                )
                 return True
 
             except Exception as e:
-                print(f"❌ Error adding documents to vectorstore: {e}")
+                ingest_log.error(f"❌ Error adding documents to vectorstore: {e}")
                 return False
         else:
-            print("ℹ️ No documents to process after cancellation check")
+            ingest_log.info("ℹ️ No documents to process after cancellation check")
             return True
     
     if not file_stats:
-        print("ℹ️ No new files to process.")
+        ingest_log.info("ℹ️ No new files to process.")
         return True
 
     return False
 
-retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 4})
+# Number of chunks retrieved per question
+RETRIEVAL_K = 4
+
+def normalize_question(question: str) -> str:
+    """Lowercase a question and collapse whitespace, so trivial variants share cache entries."""
+    return " ".join(question.lower().split())
+
+# (normalized question, database version) -> retrieved documents, most recent last
+RETRIEVAL_CACHE_SIZE = 1024
+_retrieval_cache: OrderedDict = OrderedDict()
+_retrieval_cache_lock = threading.Lock()
 
-# Create a custom chain with conversation history support
-def create_conversational_qa_chain():
-    """Create a QA chain that supports conversation history."""
+def retrieve_documents(question: str) -> Tuple[Document, ...]:
+    """
+    Get relevant documents for a question, skipping retrieval for repeated questions.
     
-    def _get_inputs(inputs):
-        """Extract inputs for the chain."""
-        question = inputs.get("question", "")
-        chat_history = inputs.get("chat_history", [])
-        
-        # Get relevant documents
-        docs = retriever.get_relevant_documents(question)
-        context = "\n\n".join([doc.page_content for doc in docs])
-        
-        # Format chat history
-        formatted_history = format_chat_history(chat_history)
+    Args:
+        question: The question as the user typed it
         
-        # Create the prompt
-        prompt = CONVERSATIONAL_QA_PROMPT.format(
-            context=context,
-            question=question,
-            chat_history=formatted_history
-        )
+    Returns:
+        The top-k documents for the question
+    """
+    # The database version makes entries go stale once documents change
+    key = (normalize_question(question), get_file_manager().db_version)
+    with _retrieval_cache_lock:
+        docs = _retrieval_cache.get(key)
+        if docs is not None:
+            _retrieval_cache.move_to_end(key)
+            return docs
+    
+    # Normalization only widens cache hits; search with the text the user typed
+    embedding = list(embed_query_cached(question))
+    docs = tuple(vectorstore.similarity_search_by_vector(embedding, k=RETRIEVAL_K))
+    with _retrieval_cache_lock:
+        _retrieval_cache[key] = docs
+        if len(_retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            _retrieval_cache.popitem(last=False)
+    return docs
+
+def build_context(docs, token_budget: int = MAX_RETRIEVED_CONTEXT_TOKENS) -> str:
+    """
+    Join retrieved chunks in relevance order until the token budget is used up.
+    
+    Args:
+        docs: Retrieved documents, most relevant first
+        token_budget: Maximum estimated tokens of context to include
         
-        return prompt
+    Returns:
+        Context text for the prompt; always includes the most relevant chunk
+    """
+    parts = []
+    used = 0
+    for doc in docs:
+        # Chunks stored before token counts were recorded are estimated here
+        tokens = doc.metadata.get('token_count') or estimate_tokens(doc.page_content)
+        if parts and used + tokens > token_budget:
+            break
+        parts.append(doc.page_content)
+        used += tokens
+    return "\n\n".join(parts)
+
+def build_qa_prompt(inputs: Dict) -> str:
+    """Retrieve context and build the QA prompt from chain inputs."""
+    question = inputs.get("question", "")
+    chat_history = inputs.get("chat_history", [])
     
-    def _call_llm(prompt):
-        """Call the LLM with the formatted prompt."""
-        try:
-            response = llm.invoke(prompt)
-            return response
-        except Exception as e:
-            print(f"LLM error: {e}")
-            return "I apologize, but I encountered an error processing your question."
+    # Get relevant documents
+    docs = retrieve_documents(question)
+    context = build_context(docs)
     
-    def chain_func(inputs):
-        """Main chain function."""
-        prompt = _get_inputs(inputs)
-        result = _call_llm(prompt)
-        return {"result": result}
+    # Format chat history
+    formatted_history = format_chat_history(chat_history)
     
-    return chain_func
+    # Create the prompt
+    return _render_qa_prompt(
+        context=context,
+        question=question,
+        chat_history=formatted_history
+    )
 
-# Initialize the conversational chain
-conversational_qa_chain = create_conversational_qa_chain()
+def _stream_llm(prompt: str) -> Iterator[str]:
+    """Yield LLM output as it is generated, ending with an apology if generation fails."""
+    try:
+        for token in llm.stream(prompt):
+            yield token
+    except Exception as e:
+        print(f"LLM error: {e}")
+        yield "\n\nI apologize, but I encountered an error processing your question."
 
-def query_knowledgebase(question: str, chat_history: List[Dict[str, str]] = None) -> str:
+def stream_knowledgebase(question: str, chat_history: List[Dict[str, str]] = None) -> Iterator[str]:
     """
-    Query the knowledge base with conversation history support.
+    Query the knowledge base, streaming the answer as the LLM produces it.
+    
+    Retrieval and prompt building happen before this returns, so callers can
+    show a spinner for that part and render tokens as they arrive.
     
     Args:
         question: The user's current question
         chat_history: List of previous messages in format [{"role": "user/assistant", "content": "..."}]
     
     Returns:
-        The assistant's response
+        Iterator over answer text fragments
     """
-    if chat_history is None:
-        chat_history = []
-    
     try:
-        result = conversational_qa_chain({
+        prompt = build_qa_prompt({
             "question": question,
-            "chat_history": chat_history
+            "chat_history": chat_history or []
         })
-        return result.get("result", "No answer found.")
     except Exception as e:
         print(f"Query error: {e}")
-        return "Sorry, I encountered an error processing your question."
\ No newline at end of file
+        return iter(["Sorry, I encountered an error processing your question."])
+    return _stream_llm(prompt)
+
+def query_knowledgebase(question: str, chat_history: List[Dict[str, str]] = None) -> str:
+    """
+    Query the knowledge base with conversation history support.
+    
+    Args:
+        question: The user's current question
+        chat_history: List of previous messages in format [{"role": "user/assistant", "content": "..."}]
+    
+    Returns:
+        The assistant's full response
+    """
+    return "".join(stream_knowledgebase(question, chat_history))
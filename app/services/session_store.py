@@ -0,0 +1,161 @@
+"""
+Session persistence service for chat history.
+Keeps an authoritative in-memory copy and flushes changes to disk in the background.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set
+from config import (
+    SESSION_STORE_DIRECTORY, SESSION_FLUSH_INTERVAL_SECONDS, SESSION_IDLE_TTL_SECONDS, SESSION_FILE_TTL_SECONDS
+)
+
+# Session ids come from the URL, so only accept the format we generate
+_SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def new_session_id() -> str:
+    """Generate a session id for a browser that doesn't have one yet"""
+    return uuid.uuid4().hex
+
+
+def is_valid_session_id(session_id: Optional[str]) -> bool:
+    """Check that a client-supplied session id is safe to use as a file name"""
+    return bool(session_id) and _SESSION_ID_PATTERN.fullmatch(session_id) is not None
+
+
+class SessionStore:
+    """Persists per-session chat history to JSON files off the request path"""
+
+    def __init__(self, directory: str = SESSION_STORE_DIRECTORY,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL_SECONDS,
+                 idle_ttl: float = SESSION_IDLE_TTL_SECONDS,
+                 file_ttl: float = SESSION_FILE_TTL_SECONDS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.idle_ttl = idle_ttl
+        self.file_ttl = file_ttl
+        self._last_prune = 0.0
+        self._sessions: Dict[str, List[Dict]] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _path(self, session_id: str) -> str:
+        """Get the JSON file path for a session"""
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _ensure_flusher(self):
+        """Start the background flush thread on first use"""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._flush_loop, name="session-store-flush", daemon=True)
+            self._thread.start()
+
+    def load(self, session_id: str) -> List[Dict]:
+        """
+        Get the history for a session, reading it from disk if not in memory.
+
+        Args:
+            session_id: Streamlit session id
+
+        Returns:
+            List of messages, empty if the session has no persisted history
+        """
+        with self._lock:
+            self._last_seen[session_id] = time.monotonic()
+            if session_id in self._sessions:
+                return self._sessions[session_id]
+
+        history = []
+        try:
+            with open(self._path(session_id), encoding="utf-8") as f:
+                history = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading session {session_id}: {e}")
+
+        with self._lock:
+            self._sessions[session_id] = history
+        return history
+
+    def mark_dirty(self, session_id: str, history: List[Dict]):
+        """
+        Record the current history for a session and schedule it for flushing.
+
+        Args:
+            session_id: Streamlit session id
+            history: The session's current history list
+        """
+        with self._lock:
+            self._sessions[session_id] = history
+            self._last_seen[session_id] = time.monotonic()
+            self._dirty.add(session_id)
+        self._ensure_flusher()
+
+    def flush(self):
+        """Write all dirty sessions to disk and evict idle ones from memory"""
+        with self._lock:
+            pending = {sid: list(self._sessions.get(sid, [])) for sid in self._dirty}
+            self._dirty.clear()
+
+        if pending:
+            os.makedirs(self.directory, exist_ok=True)
+        for session_id, history in pending.items():
+            try:
+                # Write to a temporary file first so a crash never leaves a partial file
+                tmp_path = self._path(session_id) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(history, f, ensure_ascii=False)
+                os.replace(tmp_path, self._path(session_id))
+            except Exception as e:
+                print(f"Error flushing session {session_id}: {e}")
+                with self._lock:
+                    self._dirty.add(session_id)
+
+        now = time.monotonic()
+        with self._lock:
+            idle = [sid for sid, seen in self._last_seen.items()
+                    if now - seen > self.idle_ttl and sid not in self._dirty]
+            for session_id in idle:
+                self._sessions.pop(session_id, None)
+                self._last_seen.pop(session_id, None)
+        
+        # Scanning the directory is only worth doing every idle TTL
+        if now - self._last_prune > self.idle_ttl:
+            self._last_prune = now
+            self.prune_files()
+
+    def prune_files(self):
+        """Delete persisted histories that haven't been written for the file TTL"""
+        cutoff = time.time() - self.file_ttl
+        with self._lock:
+            active = set(self._sessions)
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            session_id, ext = os.path.splitext(entry.name)
+            if ext != ".json" or session_id in active:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError as e:
+                print(f"Error pruning session file {entry.name}: {e}")
+
+    def _flush_loop(self):
+        """Background loop flushing dirty sessions every flush interval"""
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+# Create singleton instance
+session_store = SessionStore()
@@ -0,0 +1,31 @@
+"""
+Smoke tests for document splitting.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+pytest.importorskip("langchain")
+from langchain_core.documents import Document
+from services.document_loader import split_documents
+
+
+def test_split_short_text_is_one_chunk():
+    docs = [Document(page_content="A short note.", metadata={"source": "note.txt"})]
+    chunks, analysis, chunk_stats, chunk_size = split_documents(docs)
+    assert [chunk.page_content for chunk in chunks] == ["A short note."]
+    assert chunk_stats["count"] == 1
+
+
+def test_split_long_text_into_bounded_chunks():
+    paragraphs = [f"Paragraph {i}. " + "word " * 60 for i in range(40)]
+    text = "\n\n".join(paragraphs)
+    docs = [Document(page_content=text, metadata={"source": "long.txt"})]
+    chunks, analysis, chunk_stats, chunk_size = split_documents(docs)
+    assert len(chunks) > 1
+    assert all(len(chunk.page_content) <= int(chunk_size * 1.1) for chunk in chunks)
+    assert all(chunk.page_content in text for chunk in chunks)
+    assert all(chunk.metadata["source"] == "long.txt" for chunk in chunks)